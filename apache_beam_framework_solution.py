@@ -1,135 +1,211 @@
 import csv
+import io
+import operator
+import sys
 import apache_beam as beam
+import pandas as pd
+from apache_beam.options.pipeline_options import PipelineOptions
+
+# Columns of the output CSV, in the order every output row is laid out
+output_headers = ("legal_entity", "counter_party", "tier", "max(rating by counterparty)",
+                  "sum(value where status=ARAP)", "sum(value where status=ACCR)")
 
 # Define a custom Function to read CSV files
 class ReadCSVFile(beam.DoFn):
     """ Read and yield data from a CSV file.
 
+        The file is parsed by pandas' C reader in chunks rather than tokenized row by row in Python.
+
         Parameters:
         - element (str): The path to the CSV file to read.
+        - dtype (dict): Optional mapping of column name to the dtype it is converted to once on read. Other columns are
+          kept as strings exactly as they appear in the file (empty fields and values like 'NA' are not turned into NaN).
+        - chunksize (int): Number of rows parsed per chunk.
 
         Yields:
         - dict: Each row of data from the CSV file as a dictionary.
     """
+    def __init__(self, dtype=None, chunksize=65536):
+        self.dtype = dtype
+        self.chunksize = chunksize
+
     def process(self, element):
         csv_file = element
-        with open(csv_file, 'r', newline='') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                yield (row)
+        for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=self.chunksize):
+            if self.dtype:
+                chunk = chunk.astype(self.dtype)
+            yield from chunk.to_dict("records")
 
 class ReshapeData(beam.DoFn):
-    """Reshape data by adding 'tier' from dataset2 to dataset1 entries post combining the data.
+    """Reshape data by adding 'tier' from dataset2 to dataset1 entries.
 
         Parameters:
-        - element (tuple): A tuple containing data from dataset1 and dataset2.
+        - element (dict): An entry from dataset1.
+        - tiers (dict): Mapping of 'counter_party' to 'tier' from dataset2.
 
         Yields:
-        - dict: Reshaped entries with 'tier' added.
+        - tuple: Reshaped entries with 'tier' added, as a fixed-layout tuple ordered like 'fields'. Entries without a
+          matching 'counter_party' are dropped.
         """
-    def process(self, element):
-        _, data = element
-        dataset1 = data['dataset1']
-        dataset2 = data['dataset2']
+    fields = ('legal_entity', 'counter_party', 'tier', 'rating', 'value', 'status')
 
-        for entry in dataset1:
-            entry_copy = entry.copy()
-            entry_copy['tier'] = dataset2[0]['tier']
-            yield entry_copy
+    def process(self, element, tiers):
+        counter_party = element['counter_party']
+        tier = tiers.get(counter_party)
+        if tier is not None:
+            # status is interned so the per-row comparisons in AggFn mostly hit the identity fast path
+            yield (element['legal_entity'], counter_party, tier, element['rating'], element['value'],
+                   sys.intern(element['status']))
+
+def tuple_getter(items):
+    """ Build a callable that fetches the given items of its argument as a tuple.
+
+        Parameters:
+        - items (list): Keys or indices to fetch.
+
+        Returns:
+        - callable: An operator.itemgetter that always returns a tuple, even for a single item.
+    """
+    getter = operator.itemgetter(*items)
+    if len(items) == 1:
+        return lambda element: (getter(element),)
+    return getter
 
 class CompositeKeyFn(beam.DoFn):
     """ Create composite keys for grouping.
 
         Parameters:
-        - element (dict): A data element.
         - keys (list): List of keys to use for composing the composite key.
+        - element (tuple): A reshaped data element laid out like ReshapeData.fields.
 
         Yields:
-        - tuple: A tuple with a composite key and the input element.
+        - tuple: A tuple with a composite key (a tuple of the key values) and the (rating, value, status) of the element.
     """
-    def process(self, element, keys):
-        composite_key = "-".join([element[key] for key in keys])
-        yield (composite_key, element)
+    def __init__(self, keys):
+        self.keys = keys
+
+    def setup(self):
+        self._getter = tuple_getter([ReshapeData.fields.index(key) for key in self.keys])
+        self._values = tuple_getter([ReshapeData.fields.index(key) for key in ('rating', 'value', 'status')])
+
+    def process(self, element):
+        yield (self._getter(element), self._values(element))
+
 
+class AggFn(beam.CombineFn):
+    """ Perform aggregation on data elements sharing a key.
 
-class ExtractAndSum(beam.DoFn):
-    """ Perform aggregation on grouped data.
+        The accumulator is a tuple of (max rating, sum of 'ARAP' values, sum of 'ACCR' values, total count), so values
+        are reduced as they arrive instead of being grouped into a list first.
 
         Parameters:
-        - element (tuple): A tuple with a composite key and a group of data elements.
+        - input (tuple): The (rating, value, status) of a data element.
+
+        Returns:
+        - tuple: Aggregated values for the key, including max rating, sum of 'ARAP' values, sum of 'ACCR' values, and the total count.
+    """
+    def create_accumulator(self):
+        return (float("-inf"), 0, 0, 0)
+
+    def add_input(self, accumulator, input):
+        max_rating, sum_arap, sum_accr, total = accumulator
+        rating, value, status = input
+        if status == "ARAP":
+            sum_arap += value
+        elif status == "ACCR":
+            sum_accr += value
+        return (max(max_rating, rating), sum_arap, sum_accr, total + 1)
+
+    def merge_accumulators(self, accumulators):
+        max_rating, sum_arap, sum_accr, total = self.create_accumulator()
+        for accumulator in accumulators:
+            max_rating = max(max_rating, accumulator[0])
+            sum_arap += accumulator[1]
+            sum_accr += accumulator[2]
+            total += accumulator[3]
+        return (max_rating, sum_arap, sum_accr, total)
+
+    def extract_output(self, accumulator):
+        return accumulator
+
+class MergeAggFn(AggFn):
+    """ Perform aggregation on partial aggregates sharing a key.
+
+        Parameters:
+        - input (tuple): Partial aggregates as produced by AggFn.
+
+        Returns:
+        - tuple: The merged aggregates in the same layout as AggFn.
+    """
+    def add_input(self, accumulator, input):
+        return self.merge_accumulators([accumulator, input])
+
+class RollUpKeyFn(beam.DoFn):
+    """ Re-key finest-grain aggregates onto a coarser grouping.
+
+        Parameters:
+        - base_key (list): List of keys the finest composite key was composed from.
+        - keys (list): Subset of base_key to use for composing the coarser composite key.
+        - element (tuple): Aggregated values keyed by the finest composite key.
 
         Yields:
-        - tuple: Aggregated values for the group, including max rating, sum of 'ARAP' values, sum of 'ACCR' values, and the total count.
+        - tuple: A tuple with the coarser composite key and the partial aggregates.
     """
+    def __init__(self, base_key, keys):
+        self.base_key = base_key
+        self.keys = keys
+
+    def setup(self):
+        self._getter = tuple_getter([self.base_key.index(column) for column in self.keys])
+
     def process(self, element):
-        key, data = element
-        max_rating = max(int(x['rating']) for x in data)
-        sum_arap = sum(int(x['value']) for x in data if x['status'] == "ARAP")
-        sum_accr = sum(int(x['value']) for x in data if x['status'] == "ACCR")
-        total = len(data)
-        yield (key, max_rating, sum_arap, sum_accr, total)
+        key, aggregates = element
+        yield (self._getter(key), aggregates)
 
 class PrepareOutputData(beam.DoFn):
     """ Prepare the output data.
 
         Parameters:
-        - element (tuple): A tuple with aggregated values.
         - group_by_key (list): List of keys for grouping.
+        - element (tuple): A tuple with aggregated values.
 
         Yields:
-        - dict: The prepared output data with appropriate column names.
+        - tuple: The prepared output data, laid out like 'output_headers'.
     """
-    def process(self, element, group_by_key):
-        aggr_columns =  ['legal_entity', 'counter_party', 'tier']
-        key, max_rating, sum_arap, sum_accr, total = element
-        split_key = key.split("-")
-
-        result_dict = {}
-        for i, key in enumerate(group_by_key):
-            result_dict[key] = split_key[i]
-
-        for column in aggr_columns:
-            if column not in result_dict:
-                result_dict[column] = total
+    def __init__(self, group_by_key):
+        self.group_by_key = group_by_key
 
-        result_dict["max(rating by counterparty)"] = max_rating   
-        result_dict["sum(value where status=ARAP)"] = sum_arap
-        result_dict["sum(value where status=ACCR)"] = sum_accr
-        
-        yield result_dict
-
-class SaveOutputToCsv(beam.DoFn):
-    def __init__(self, output_file):
-        self.output_file = output_file
+    def setup(self):
+        aggr_columns =  ['legal_entity', 'counter_party', 'tier']
+        # Position of each column within the composite key; columns not part of the grouping are filled with the total
+        self._key_positions = [self.group_by_key.index(column) if column in self.group_by_key else None
+                               for column in aggr_columns]
 
     def process(self, element):
-        """ Save the output data to a CSV file in a specific format.
+        key, max_rating, sum_arap, sum_accr, total = element
+        yield (*[total if position is None else key[position] for position in self._key_positions],
+               max_rating, sum_arap, sum_accr)
+
+class FormatCsvRow(beam.DoFn):
+    """ Format the output data as CSV lines.
 
         Parameters:
-        - element: The data to save to the output file.
+        - element (tuple): The prepared output data, laid out like 'output_headers'.
 
         Yields:
-        - str: The path to the output file.
-        """
-        headers = ["legal_entity", "counter_party", "tier", "max(rating by counterparty)", 
-                   "sum(value where status=ARAP)", "sum(value where status=ACCR)"]
-        
-        with open(self.output_file, 'a', newline='') as file: 
-            writer = csv.DictWriter(file, fieldnames=headers)
-            if file.tell() == 0:
-                writer.writeheader()  # Write header only if the file is empty
-            for row in element:
-                # Assuming the input data is a dictionary
-                row_to_write = {
-                    "legal_entity": row["legal_entity"],
-                    "counter_party": row["counter_party"],
-                    "tier": row["tier"],
-                    "max(rating by counterparty)": row["max(rating by counterparty)"],
-                    "sum(value where status=ARAP)": row["sum(value where status=ARAP)"],
-                    "sum(value where status=ACCR)": row["sum(value where status=ACCR)"]
-                }
-                writer.writerow(row_to_write)
-        yield self.output_file
+        - str: The output data as one CSV line, without line terminator.
+    """
+    def setup(self):
+        # One reusable buffer and writer so quoting is handled by the csv module without per-row setup
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="")
+
+    def process(self, element):
+        self._writer.writerow(element)
+        line = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        yield line
 
 if __name__ == "__main__":
     # Define a list of group_by_columns that encompasses all possible combinations of 1, 2, and 3 columns at a time.
@@ -139,13 +215,16 @@ if __name__ == "__main__":
         ['legal_entity', 'counter_party', 'tier']
     ]
     
-    with beam.Pipeline() as p:
+    # These are the DirectRunner defaults, pinned explicitly: the input is small, so it runs on a single in-memory worker
+    options = PipelineOptions(direct_num_workers=1, direct_running_mode="in_memory")
+
+    with beam.Pipeline(options=options) as p:
         # Read and process dataset1
         dataset1 = (
             p
             | "Read Dataset1" >> beam.Create(["dataset1.csv"])  
-            | "Read CSV File1" >> beam.ParDo(ReadCSVFile()) 
-            | "Map to key-value1" >> beam.Map(lambda cols: (cols["counter_party"], cols)) 
+            # Numeric fields are parsed once on read instead of per group in every aggregation
+            | "Read CSV File1" >> beam.ParDo(ReadCSVFile({"rating": "int64", "value": "int64"}))
         )
         
         # Read and process dataset2
@@ -153,27 +232,45 @@ if __name__ == "__main__":
             p
             | "Read Dataset2" >> beam.Create(["dataset2.csv"])  
             | "Read CSV File2" >> beam.ParDo(ReadCSVFile()) 
-            | "Map to key-value2" >> beam.Map(lambda cols: (cols["counter_party"], cols)) # This is Mapped so that we can merge data later on based on counter_party
+            | "Map to key-value2" >> beam.Map(lambda cols: (cols["counter_party"], cols["tier"])) # This is Mapped so that we can look up the tier by counter_party
         )
         
         # Merge the data from dataset1 and dataset2 based on 'counter_party'
+        # dataset2 is a small lookup table, so it is broadcast as a side input instead of shuffling and buffering
+        # every dataset1 row per counter_party through CoGroupByKey
         merged_data = (
-            ({"dataset1": dataset1, "dataset2": dataset2}) 
-            | "Merging" >> beam.CoGroupByKey() # Both dataset are combined based on the common key 'counter_party' mapped earlier
-            | "Reshape Data" >> beam.ParDo(ReshapeData())
+            dataset1
+            | "Reshape Data" >> beam.ParDo(ReshapeData(), tiers=beam.pvalue.AsDict(dataset2))
         )
         
+        # Aggregate once at the finest grain; every other grouping is a roll-up of these partial results
+        base_key = ['legal_entity', 'counter_party', 'tier']
+        base_data = (
+            merged_data
+            # Composite key is being created to handle grouping of data on multiple keys e.g. ['legal_entity', 'counter_party']
+            | "Create Composite Key" >> beam.ParDo(CompositeKeyFn(base_key))
+            # Values are combined per key before the shuffle instead of being grouped into lists
+            | "Perform Aggregations" >> beam.CombinePerKey(AggFn())
+        )
+
         # Apache Beam is designed for parallel processes so the data written will not be in order
         # Process data for each group_by_key
+        grouped_data = []
         for group_by_key in group_by_columns:
-            grouped_data = (
-                merged_data 
-                # Composite key is being created to handle grouping of data on multiple keys e.g. ['legal_entity', 'counter_party']
-                | f"Create Composite Key {group_by_key}" >> beam.ParDo(CompositeKeyFn(), group_by_key) 
-                | f"Group by Composite Key {group_by_key}" >> beam.GroupBy(lambda x: x[0]) # Group the dict elements by different keys of 1,2 and 3 combinations at a time  
-                | f"Remove extra composite key Element {group_by_key}" >> beam.Map(lambda group: (group[0], [x[1] for x in group[1]] ))
-                | f"Perform Aggregations {group_by_key}" >> beam.ParDo(ExtractAndSum())
-                | f"Prepare Output Data {group_by_key}" >> beam.ParDo(PrepareOutputData(), group_by_key) 
-                | f"Collect Output Data {group_by_key}" >> beam.combiners.ToList()
-                | f"Save Output to CSV {group_by_key}" >> beam.ParDo(SaveOutputToCsv("apache_beam_framework_output.csv"))
+            grouped_data.append(
+                base_data
+                | f"Roll Up Key {group_by_key}" >> beam.ParDo(RollUpKeyFn(base_key, group_by_key))
+                | f"Merge Aggregations {group_by_key}" >> beam.CombinePerKey(MergeAggFn())
+                | f"Flatten Aggregations {group_by_key}" >> beam.Map(lambda kv: (kv[0], *kv[1]))
+                | f"Prepare Output Data {group_by_key}" >> beam.ParDo(PrepareOutputData(group_by_key))
             )
+
+        # All groupings are written together by a single sink into one unsharded file
+        (
+            grouped_data
+            | "Merge Output Data" >> beam.Flatten()
+            | "Format Output Data" >> beam.ParDo(FormatCsvRow())
+            | "Save Output to CSV" >> beam.io.WriteToText("apache_beam_framework_output", file_name_suffix=".csv",
+                                                           num_shards=1, shard_name_template="",
+                                                           header=",".join(output_headers))
+        )
@@ -0,0 +1,61 @@
+import apache_beam as beam
+from apache_beam.testing import test_pipeline
+from apache_beam.testing.util import assert_that, equal_to
+
+from apache_beam_framework_solution import (AggFn, CompositeKeyFn, MergeAggFn, PrepareOutputData, ReshapeData,
+                                            RollUpKeyFn)
+
+
+# Rows as emitted by ReadCSVFile; counter parties contain "-" so a string-joined composite key would split wrongly
+ROWS = [
+    {"invoice_id": "1", "legal_entity": "L1", "counter_party": "C-1", "rating": 1, "status": "ARAP", "value": 10},
+    {"invoice_id": "2", "legal_entity": "L1", "counter_party": "C-1", "rating": 3, "status": "ACCR", "value": 40},
+    {"invoice_id": "3", "legal_entity": "L2", "counter_party": "C-1", "rating": 2, "status": "ARAP", "value": 5},
+    {"invoice_id": "4", "legal_entity": "L1", "counter_party": "C-2", "rating": 6, "status": "ARAP", "value": 7},
+    # No tier for this counter party, so the join drops it
+    {"invoice_id": "5", "legal_entity": "L1", "counter_party": "C-9", "rating": 9, "status": "ARAP", "value": 100},
+]
+
+TIERS = [("C-1", "1"), ("C-2", "2")]
+
+BASE_KEY = ['legal_entity', 'counter_party', 'tier']
+
+# Output rows laid out like output_headers; columns outside the grouping hold the group's total count
+EXPECTED = {
+    ('counter_party',): [
+        (3, "C-1", 3, 3, 15, 40),
+        (1, "C-2", 1, 6, 7, 0),
+    ],
+    ('tier', 'legal_entity'): [
+        ("L1", 2, "1", 3, 10, 40),
+        ("L2", 1, "1", 2, 5, 0),
+        ("L1", 1, "2", 6, 7, 0),
+    ],
+    ('legal_entity', 'counter_party', 'tier'): [
+        ("L1", "C-1", "1", 3, 10, 40),
+        ("L2", "C-1", "1", 2, 5, 0),
+        ("L1", "C-2", "2", 6, 7, 0),
+    ],
+}
+
+
+def test_aggregation_chain_with_dashes_in_keys():
+    with test_pipeline.TestPipeline() as p:
+        tiers = p | "Create Tiers" >> beam.Create(TIERS)
+        base_data = (
+            p
+            | "Create Rows" >> beam.Create(ROWS)
+            | "Reshape Data" >> beam.ParDo(ReshapeData(), tiers=beam.pvalue.AsDict(tiers))
+            | "Create Composite Key" >> beam.ParDo(CompositeKeyFn(BASE_KEY))
+            | "Perform Aggregations" >> beam.CombinePerKey(AggFn())
+        )
+
+        for group_by_key, expected in EXPECTED.items():
+            output = (
+                base_data
+                | f"Roll Up Key {group_by_key}" >> beam.ParDo(RollUpKeyFn(BASE_KEY, list(group_by_key)))
+                | f"Merge Aggregations {group_by_key}" >> beam.CombinePerKey(MergeAggFn())
+                | f"Flatten Aggregations {group_by_key}" >> beam.Map(lambda kv: (kv[0], *kv[1]))
+                | f"Prepare Output Data {group_by_key}" >> beam.ParDo(PrepareOutputData(list(group_by_key)))
+            )
+            assert_that(output, equal_to(expected), label=f"Check {group_by_key}")
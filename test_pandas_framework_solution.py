@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+import pandas_framework_solution
+
+
+DATASET1 = """invoice_id,legal_entity,counter_party,rating,status,value
+1,L1,C1,1,ARAP,10
+2,,C1,6,ACCR,20
+3,L2,C2,2,ACCR,30
+4,L1,C1,3,ARAP,40
+5,L2,C2,5,ARAP,50
+6,,C2,4,ARAP,60
+7,L1,C3,2,ACCR,70
+"""
+
+DATASET2 = """counter_party,tier
+C1,1
+C2,2
+C3,3
+"""
+
+# Rows 2 and 6 have no legal_entity and belong to no group
+EXPECTED = [
+    # legal_entity, counter_party, tier, total, max_rating, sum_arap, sum_accr
+    ("L1", "C1", 1, 2, 3, 50, 0),
+    ("L1", "C3", 3, 1, 2, 0, 70),
+    ("L2", "C2", 2, 2, 5, 50, 30),
+]
+
+
+@pytest.fixture
+def df(tmp_path):
+    dataset1 = tmp_path / "dataset1.csv"
+    dataset2 = tmp_path / "dataset2.csv"
+    dataset1.write_text(DATASET1)
+    dataset2.write_text(DATASET2)
+    return pandas_framework_solution.load_data(str(dataset1), str(dataset2))
+
+
+def as_rows(result):
+    columns = ["legal_entity", "counter_party", "tier", "total", "max_rating", "sum_arap", "sum_accr"]
+    rows = [(str(le), str(cp), int(tier), int(total), int(max_rating), int(sum_arap), int(sum_accr))
+            for le, cp, tier, total, max_rating, sum_arap, sum_accr in result[columns].itertuples(index=False)]
+    return sorted(rows)
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_aggregate_finest_grain_with_missing_keys(df, monkeypatch, use_numba):
+    if use_numba:
+        pytest.importorskip("numba")
+        assert pandas_framework_solution.njit is not None
+    else:
+        monkeypatch.setattr(pandas_framework_solution, "njit", None)
+
+    result = pandas_framework_solution.aggregate_finest_grain(df)
+
+    assert as_rows(result) == EXPECTED